@@ -0,0 +1,11 @@
+import functools
+import importlib
+from typing import Type
+
+from .base import BaseConnector
+
+@functools.cache
+def get_connector(name: str) -> Type[BaseConnector]:
+    """Resolve a connector type name (e.g. "webhook") to its class in app.connectors.<name>"""
+    module = importlib.import_module(f".{name}", __name__)
+    return getattr(module, f"{name.capitalize()}Connector")
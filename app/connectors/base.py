@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+import httpx
 
 class ConnectorResult:
     def __init__(self, success: bool, message: str, data: Dict[str, Any] = None):
@@ -8,8 +9,22 @@ class ConnectorResult:
         self.data = data or {}
 
 class BaseConnector(ABC):
-    def __init__(self, config: Dict[str, Any]):
+    # True when execute() enforces timeout_seconds itself, so the engine
+    # does not need to wrap the call in an asyncio timeout
+    handles_timeout = False
+    # True when __init__ takes the http_client and timeout_seconds keywords;
+    # connectors written against the original __init__(config) leave it False
+    accepts_engine_options = False
+    
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        http_client: Optional[httpx.AsyncClient] = None,
+        timeout_seconds: Optional[float] = None
+    ):
         self.config = config
+        self.http_client = http_client  # Shared client owned by the app lifespan
+        self.timeout_seconds = timeout_seconds
     
     @abstractmethod
     async def execute(self, context: Dict[str, Any]) -> ConnectorResult:
@@ -19,5 +34,9 @@ class BaseConnector(ABC):
     @classmethod
     @abstractmethod
     def get_config_schema(cls) -> Dict[str, Any]:
-        """Return JSON schema for connector configuration"""
+        """Return JSON schema for connector configuration.
+        
+        Built-in connectors cache the result with functools.cache, so every call
+        returns the same dict: treat it as read-only and copy before changing it.
+        """
         pass
\ No newline at end of file
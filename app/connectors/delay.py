@@ -1,18 +1,12 @@
 import asyncio
-import sys
-import os
+import functools
 from typing import Dict, Any
 
-# Add the parent directory to the path so we can import from app
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-
-try:
-    from .base import BaseConnector, ConnectorResult
-except ImportError:
-    # Fallback for direct execution
-    from app.connectors.base import BaseConnector, ConnectorResult
+from .base import BaseConnector, ConnectorResult
 
 class DelayConnector(BaseConnector):
+    accepts_engine_options = True
+    
     async def execute(self, context: Dict[str, Any]) -> ConnectorResult:
         try:
             delay_seconds = self.config.get("seconds", 1)
@@ -31,6 +25,7 @@ class DelayConnector(BaseConnector):
             )
     
     @classmethod
+    @functools.cache
     def get_config_schema(cls) -> Dict[str, Any]:
         return {
             "type": "object",
@@ -1,63 +1,147 @@
+import functools
+import re
 import httpx
-import sys
-import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
-# Add the parent directory to the path so we can import from app
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from .base import BaseConnector, ConnectorResult
 
-try:
-    from .base import BaseConnector, ConnectorResult
-except ImportError:
-    # Fallback for direct execution
-    from app.connectors.base import BaseConnector, ConnectorResult
+# Matches any {{key}} placeholder; used once per connector to discover keys
+_PLACEHOLDER_RE = re.compile(r"\{\{(.+?)\}\}")
+
+# Which httpx.Timeout field applied, by the timeout exception raised
+_TIMEOUT_PHASES = (
+    (httpx.ConnectTimeout, "connect"),
+    (httpx.ReadTimeout, "read"),
+    (httpx.WriteTimeout, "write"),
+    (httpx.PoolTimeout, "pool"),
+)
 
 class WebhookConnector(BaseConnector):
+    handles_timeout = True  # Enforced by httpx so the socket is cancelled by the transport
+    accepts_engine_options = True
+    
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        http_client: Optional[httpx.AsyncClient] = None,
+        timeout_seconds: Optional[float] = None
+    ):
+        super().__init__(config, http_client, timeout_seconds)
+        self._timeout = httpx.Timeout(timeout_seconds) if timeout_seconds else httpx.USE_CLIENT_DEFAULT
+        
+        # Record where placeholders occur, as (path, template) pairs, so rendering
+        # only touches those leaves instead of rebuilding the whole body
+        self._body = self.config.get("body", {})
+        self._patches: List[Tuple[tuple, str]] = self._collect_patches(self._body, (), [])
+        
+        # Build a single alternation regex for the placeholders present in the body,
+        # so rendering is one linear pass per string instead of one scan per context key
+        placeholders = {key for _, tpl in self._patches for key in _PLACEHOLDER_RE.findall(tpl)}
+        if placeholders:
+            self._tpl_re = re.compile(
+                r"\{\{(" + "|".join(map(re.escape, sorted(placeholders))) + r")\}\}"
+            )
+        else:
+            self._tpl_re = None
+    
     async def execute(self, context: Dict[str, Any]) -> ConnectorResult:
+        client = self.http_client
         try:
             url = self.config["url"]
             method = self.config.get("method", "POST").upper()
             headers = self.config.get("headers", {})
-            body = self.config.get("body", {})
             
             # Replace placeholders in body with context data
-            processed_body = self._process_template(body, context)
+            processed_body = self._render_body(context)
             
-            async with httpx.AsyncClient() as client:
-                response = await client.request(
-                    method=method,
-                    url=url,
-                    headers=headers,
-                    json=processed_body if method in ["POST", "PUT", "PATCH"] else None
-                )
-                
-                return ConnectorResult(
-                    success=response.status_code < 400,
-                    message=f"Webhook {method} to {url}: {response.status_code}",
-                    data={
-                        "status_code": response.status_code,
-                        "response_body": response.text[:1000]  # Truncate long responses
-                    }
-                )
+            request_kwargs = {
+                "method": method,
+                "url": url,
+                "headers": headers,
+                "json": processed_body if method in ["POST", "PUT", "PATCH"] else None,
+                "timeout": self._timeout
+            }
+            
+            if client is not None:
+                # Reuse pooled keep-alive connections from the shared client
+                response = await client.request(**request_kwargs)
+            else:
+                # Standalone use (e.g. debug scripts) without an app-managed client
+                async with httpx.AsyncClient() as client:
+                    response = await client.request(**request_kwargs)
+            
+            return ConnectorResult(
+                success=response.status_code < 400,
+                message=f"Webhook {method} to {url}: {response.status_code}",
+                data={
+                    "status_code": response.status_code,
+                    "response_body": response.text[:1000]  # Truncate long responses
+                }
+            )
+        except httpx.TimeoutException as e:
+            return ConnectorResult(
+                success=False,
+                message=self._timeout_message(client, e)
+            )
         except Exception as e:
             return ConnectorResult(
                 success=False,
                 message=f"Webhook failed: {str(e)}"
             )
     
-    def _process_template(self, data: Any, context: Dict[str, Any]) -> Any:
-        """Simple template processing - replace {{key}} with context values"""
+    def _timeout_message(self, client: Optional[httpx.AsyncClient], error: httpx.TimeoutException) -> str:
+        """Describe a timeout using the limit that applied: the step's, else the client's"""
+        seconds = self.timeout_seconds
+        if not seconds and client is not None:
+            phase = next((name for cls, name in _TIMEOUT_PHASES if isinstance(error, cls)), "read")
+            seconds = getattr(client.timeout, phase)
+        if seconds:
+            return f"Step timed out after {seconds}s"
+        return f"Webhook timed out: {error}"
+    
+    def _collect_patches(self, data: Any, path: tuple, patches: List[Tuple[tuple, str]]) -> List[Tuple[tuple, str]]:
+        """Collect (path, template) for every string leaf that contains a {{key}} placeholder"""
         if isinstance(data, str):
-            for key, value in context.items():
-                data = data.replace(f"{{{{{key}}}}}", str(value))
-            return data
+            if _PLACEHOLDER_RE.search(data):
+                patches.append((path, data))
         elif isinstance(data, dict):
-            return {k: self._process_template(v, context) for k, v in data.items()}
+            for key, value in data.items():
+                self._collect_patches(value, path + (key,), patches)
         elif isinstance(data, list):
-            return [self._process_template(item, context) for item in data]
-        return data
+            for index, item in enumerate(data):
+                self._collect_patches(item, path + (index,), patches)
+        return patches
+    
+    def _render_body(self, context: Dict[str, Any]) -> Any:
+        """Simple template processing - replace {{key}} with context values"""
+        if not self._patches:
+            return self._body  # Nothing to substitute; the template is never mutated
+        
+        def render(template: str) -> str:
+            return self._tpl_re.sub(lambda m: str(context.get(m.group(1), m.group(0))), template)
+        
+        if self._patches[0][0] == ():
+            return render(self._patches[0][1])  # The body itself is a template string
+        
+        # Copy only the containers on the way to a patched leaf; untouched
+        # subtrees stay shared with the template
+        body = self._body.copy()
+        copied = {(): body}
+        for path, template in self._patches:
+            node = body
+            for depth in range(1, len(path)):
+                prefix = path[:depth]
+                child = copied.get(prefix)
+                if child is None:
+                    child = node[path[depth - 1]].copy()
+                    node[path[depth - 1]] = child
+                    copied[prefix] = child
+                node = child
+            node[path[-1]] = render(template)
+        return body
     
     @classmethod
+    @functools.cache
     def get_config_schema(cls) -> Dict[str, Any]:
         return {
             "type": "object",
@@ -1,26 +1,111 @@
+from contextlib import asynccontextmanager
 import json
-import sys
 import os
-from typing import List, Optional
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select, desc, text
+import re
+import orjson
+from typing import AsyncIterator, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import Row, event, select, insert, update, desc, text
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-# Add the parent directory to the path so we can import from app
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from .models import Base, WorkflowRun, WorkflowRunLog, WorkflowStatus
 
-try:
-    from .models import Base, WorkflowRun, WorkflowStatus
-except ImportError:
-    # Fallback for direct execution
-    from app.models import Base, WorkflowRun, WorkflowStatus
+# Applied to every new SQLite connection: WAL lets readers run alongside the
+# writer and, with synchronous=NORMAL, commits no longer fsync every time
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Columns returned by the run API; selected explicitly so payload text is never loaded
+_RUN_RESPONSE_COLUMNS = (
+    WorkflowRun.id,
+    WorkflowRun.workflow_name,
+    WorkflowRun.status,
+    WorkflowRun.retry_count,
+    WorkflowRun.max_retries,
+    WorkflowRun.current_step,
+    WorkflowRun.created_at,
+    WorkflowRun.updated_at,
+)
+
+# orjson only handles 64-bit integers, while request bodies may carry any int;
+# such values go through the stdlib json module so they round-trip exactly
+_LONG_DIGITS_RE = re.compile(r"\d{19,}")
+
+def _json_dumps(value) -> str:
+    try:
+        return orjson.dumps(value).decode()
+    except TypeError:  # Integer exceeds 64-bit range
+        return json.dumps(value)
+
+def _json_loads(text: str):
+    # orjson would silently turn out-of-range integers into floats
+    if _LONG_DIGITS_RE.search(text):
+        return json.loads(text)
+    return orjson.loads(text)
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    # Disable the driver's implicit transaction handling; BEGIN is emitted below
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for pragma in _SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+def _begin_sqlite_transaction(conn):
+    conn.exec_driver_sql("BEGIN")
 
 class Database:
-    def __init__(self, database_url: str = "sqlite+aiosqlite:///./workflows.db"):
-        self.engine = create_async_engine(database_url, echo=False)
-        self.async_session = sessionmaker(
-            self.engine, class_=AsyncSession, expire_on_commit=False
+    def __init__(self, database_url: Optional[str] = None):
+        if database_url is None:
+            database_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./workflows.db")
+        engine_kwargs = {}
+        if ":memory:" not in database_url:
+            # One pooled connection set shared by the API and every running workflow;
+            # in-memory SQLite keeps its default single static connection instead
+            engine_kwargs.update(
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=25,
+                max_overflow=0,
+                pool_recycle=1800,
+            )
+        self.engine = create_async_engine(
+            database_url,
+            echo=False,
+            # JSON columns (trigger_payload) encode and decode through orjson
+            json_serializer=_json_dumps,
+            json_deserializer=_json_loads,
+            **engine_kwargs
         )
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine.sync_engine, "connect", _configure_sqlite_connection)
+            event.listen(self.engine.sync_engine, "begin", _begin_sqlite_transaction)
+        self.async_session = async_sessionmaker(self.engine, expire_on_commit=False)
+    
+    def run_session(self) -> AsyncSession:
+        """Open a session that a caller can reuse across many data-access calls"""
+        return self.async_session()
+    
+    @asynccontextmanager
+    async def _transaction(self, session: Optional[AsyncSession]) -> AsyncIterator[AsyncSession]:
+        """Yield a session inside a transaction.
+        
+        Without a session a new one is opened for this call. A caller's session
+        joins its open transaction, or gets its own short one committed on exit.
+        """
+        if session is None:
+            async with self.async_session() as own_session, own_session.begin():
+                yield own_session
+        elif session.in_transaction():
+            yield session
+        else:
+            async with session.begin():
+                yield session
     
     async def init_db(self):
         async with self.engine.begin() as conn:
@@ -44,13 +129,48 @@ class Database:
             if 'current_step' not in columns:
                 migrations_needed.append("ALTER TABLE workflow_runs ADD COLUMN current_step INTEGER DEFAULT 0")
             
+            result = await conn.execute(text("PRAGMA index_list(workflow_runs)"))
+            indexes = [row[1] for row in result.fetchall()]
+            if 'ix_workflow_runs_created_at_id' not in indexes:
+                migrations_needed.append(
+                    "CREATE INDEX ix_workflow_runs_created_at_id ON workflow_runs (created_at DESC, id)"
+                )
+            if 'ix_workflow_runs_status_updated' not in indexes:
+                migrations_needed.append(
+                    "CREATE INDEX ix_workflow_runs_status_updated ON workflow_runs (status, updated_at)"
+                )
+            
+            # trigger_payload moved from a Text column holding json.dumps output to
+            # the JSON type; keep any row that is not valid JSON readable as a string
+            result = await conn.execute(text("PRAGMA user_version"))
+            user_version = result.scalar()
+            if user_version < 1:
+                migrations_needed.append(
+                    "UPDATE workflow_runs SET trigger_payload = json_quote(trigger_payload) "
+                    "WHERE trigger_payload IS NOT NULL AND json_valid(trigger_payload) = 0"
+                )
+                migrations_needed.append("PRAGMA user_version = 1")
+                user_version = 1
+            
+            # Logs moved from a JSON array in workflow_runs.logs to one row per line
+            # in workflow_run_logs; copy the lines of runs from before the split
+            if user_version < 2:
+                if 'logs' in columns:
+                    migrations_needed.append(
+                        "INSERT OR IGNORE INTO workflow_run_logs (run_id, seq, ts, msg) "
+                        "SELECT r.id, j.key, COALESCE(r.updated_at, CURRENT_TIMESTAMP), j.value "
+                        "FROM workflow_runs r, json_each(r.logs) j "
+                        "WHERE r.logs IS NOT NULL AND json_valid(r.logs) AND json_type(r.logs) = 'array'"
+                    )
+                migrations_needed.append("PRAGMA user_version = 2")
+            
             # Execute migrations
             for migration in migrations_needed:
                 await conn.execute(text(migration))
                 print(f"✅ Applied migration: {migration}")
             
             if migrations_needed:
-                print(f"🔄 Database schema updated with {len(migrations_needed)} new columns")
+                print(f"🔄 Database schema updated with {len(migrations_needed)} migrations")
             
         except Exception as e:
             print(f"⚠️  Migration warning: {e}")
@@ -60,75 +180,151 @@ class Database:
         self, 
         workflow_name: str, 
         trigger_payload: dict,
-        max_retries: int = 3
-    ) -> WorkflowRun:
-        async with self.async_session() as session:
-            run = WorkflowRun(
-                workflow_name=workflow_name,
-                trigger_payload=json.dumps(trigger_payload),
-                logs=json.dumps([]),
-                max_retries=max_retries
+        max_retries: int = 3,
+        session: Optional[AsyncSession] = None
+    ) -> Row:
+        """Insert a run and return its API columns via RETURNING (no re-SELECT)"""
+        async with self._transaction(session) as session:
+            stmt = (
+                insert(WorkflowRun)
+                .values(
+                    workflow_name=workflow_name,
+                    trigger_payload=trigger_payload,
+                    max_retries=max_retries
+                )
+                .returning(*_RUN_RESPONSE_COLUMNS)
             )
-            session.add(run)
-            await session.commit()
-            await session.refresh(run)
-            return run
+            return (await session.execute(stmt)).one()
     
     async def update_workflow_run(
         self, 
         run_id: int, 
         status: WorkflowStatus, 
-        logs: List[str],
+        logs: List[Tuple[int, str]],
         retry_count: int = None,
-        current_step: int = None
+        current_step: int = None,
+        session: Optional[AsyncSession] = None
     ):
-        async with self.async_session() as session:
-            run = await session.get(WorkflowRun, run_id)
-            if run:
-                run.status = status
-                run.logs = json.dumps(logs)
-                if retry_count is not None:
-                    run.retry_count = retry_count
-                if current_step is not None:
-                    run.current_step = current_step
-                await session.commit()
-    
-    async def pause_workflow(self, run_id: int) -> bool:
+        """Update run status and append any new (seq, message) log lines"""
+        values = {"status": status}
+        if retry_count is not None:
+            values["retry_count"] = retry_count
+        if current_step is not None:
+            values["current_step"] = current_step
+        
+        # Status and log lines share one transaction, and so one commit
+        async with self._transaction(session) as session:
+            await session.execute(
+                update(WorkflowRun).where(WorkflowRun.id == run_id).values(**values)
+            )
+            await self._insert_logs(session, run_id, logs)
+    
+    async def append_run_logs(self, run_id: int, logs: List[Tuple[int, str]], session: Optional[AsyncSession] = None):
+        """Append (seq, message) log lines without touching the run row"""
+        if not logs:
+            return
+        async with self._transaction(session) as session:
+            await self._insert_logs(session, run_id, logs)
+    
+    async def _insert_logs(self, session: AsyncSession, run_id: int, logs: List[Tuple[int, str]]):
+        if logs:
+            await session.execute(
+                insert(WorkflowRunLog),
+                [{"run_id": run_id, "seq": seq, "msg": msg} for seq, msg in logs]
+            )
+    
+    async def pause_workflow(self, run_id: int, session: Optional[AsyncSession] = None) -> bool:
         """Pause a workflow"""
-        async with self.async_session() as session:
-            run = await session.get(WorkflowRun, run_id)
-            if run and run.status in [WorkflowStatus.STARTED, WorkflowStatus.RETRYING]:
-                run.status = WorkflowStatus.PAUSED
-                await session.commit()
-                return True
-            return False
-    
-    async def stop_workflow(self, run_id: int) -> bool:
+        return await self._set_status_if(
+            run_id,
+            WorkflowRun.status.in_([WorkflowStatus.STARTED, WorkflowStatus.RETRYING]),
+            WorkflowStatus.PAUSED,
+            session
+        )
+    
+    async def stop_workflow(self, run_id: int, session: Optional[AsyncSession] = None) -> bool:
         """Stop a workflow permanently"""
-        async with self.async_session() as session:
-            run = await session.get(WorkflowRun, run_id)
-            if run and run.status != WorkflowStatus.STOPPED:
-                run.status = WorkflowStatus.STOPPED
-                await session.commit()
-                return True
-            return False
-    
-    async def resume_workflow(self, run_id: int) -> bool:
+        return await self._set_status_if(
+            run_id,
+            WorkflowRun.status != WorkflowStatus.STOPPED,
+            WorkflowStatus.STOPPED,
+            session
+        )
+    
+    async def resume_workflow(self, run_id: int, session: Optional[AsyncSession] = None) -> bool:
         """Resume a paused workflow"""
-        async with self.async_session() as session:
-            run = await session.get(WorkflowRun, run_id)
-            if run and run.status == WorkflowStatus.PAUSED:
-                run.status = WorkflowStatus.STARTED
-                await session.commit()
-                return True
-            return False
-    
-    async def get_workflow_run(self, run_id: int) -> Optional[WorkflowRun]:
-        async with self.async_session() as session:
+        return await self._set_status_if(
+            run_id,
+            WorkflowRun.status == WorkflowStatus.PAUSED,
+            WorkflowStatus.STARTED,
+            session
+        )
+    
+    async def _set_status_if(self, run_id: int, condition, status: WorkflowStatus, session: Optional[AsyncSession]) -> bool:
+        """Set the status in one conditional UPDATE; True if the run matched the condition"""
+        async with self._transaction(session) as session:
+            result = await session.execute(
+                update(WorkflowRun)
+                .where(WorkflowRun.id == run_id, condition)
+                .values(status=status)
+                .execution_options(synchronize_session=False)
+            )
+            return result.rowcount > 0
+    
+    async def get_workflow_run(self, run_id: int, session: Optional[AsyncSession] = None) -> Optional[WorkflowRun]:
+        async with self._transaction(session) as session:
             return await session.get(WorkflowRun, run_id)
     
-    async def get_workflow_runs(self, limit: int = 100) -> List[WorkflowRun]:
-        async with self.async_session() as session:
-            stmt = select(WorkflowRun).order_by(desc(WorkflowRun.created_at)).limit(limit)
+    async def get_workflow_status(self, run_id: int, session: Optional[AsyncSession] = None) -> Optional[WorkflowStatus]:
+        """Fetch only the status column of a run"""
+        async with self._transaction(session) as session:
+            result = await session.execute(
+                select(WorkflowRun.status).where(WorkflowRun.id == run_id)
+            )
+            return result.scalar_one_or_none()
+    
+    async def get_workflow_run_summary(self, run_id: int, session: Optional[AsyncSession] = None) -> Optional[Row]:
+        """Fetch one run's API columns without its payload"""
+        async with self._transaction(session) as session:
+            result = await session.execute(
+                select(*_RUN_RESPONSE_COLUMNS).where(WorkflowRun.id == run_id)
+            )
+            return result.one_or_none()
+    
+    async def stream_run_logs(self, run_id: int, tail: Optional[int] = None, batch_size: int = 256) -> AsyncIterator[List[str]]:
+        """Yield a run's log lines in seq order, batch_size rows at a time.
+        
+        With tail, only the last N lines are read; the database picks them
+        (ORDER BY seq DESC LIMIT N) and hands them back in ascending order.
+        """
+        if tail is None:
+            stmt = (
+                select(WorkflowRunLog.msg)
+                .where(WorkflowRunLog.run_id == run_id)
+                .order_by(WorkflowRunLog.seq)
+            )
+        else:
+            last = (
+                select(WorkflowRunLog.seq, WorkflowRunLog.msg)
+                .where(WorkflowRunLog.run_id == run_id)
+                .order_by(WorkflowRunLog.seq.desc())
+                .limit(tail)
+                .subquery()
+            )
+            stmt = select(last.c.msg).order_by(last.c.seq)
+        
+        async with self._transaction(None) as session:
+            result = await session.stream(stmt.execution_options(yield_per=batch_size))
+            async for batch in result.scalars().partitions():
+                yield batch
+    
+    async def get_workflow_runs(self, limit: int = 100, session: Optional[AsyncSession] = None) -> List[Row]:
+        """List recent runs, selecting only the columns the API responds with"""
+        async with self._transaction(session) as session:
+            stmt = (
+                select(*_RUN_RESPONSE_COLUMNS)
+                .order_by(desc(WorkflowRun.created_at))
+                .limit(limit)
+            )
             result = await session.execute(stmt)
-            return result.scalars().all()
\ No newline at end of file
+            return result.all()
\ No newline at end of file
@@ -1,40 +1,61 @@
 import asyncio
-import sys
 import os
-from typing import List
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import httpx
+import orjson
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-# Add the parent directory to the path so we can import from app
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from .models import TriggerRequest, WorkflowRunResponse, WorkflowStatus, WorkflowControlRequest
+from .database import Database
+from .workflow_engine import WorkflowEngine
 
-try:
-    from .models import TriggerRequest, WorkflowRunResponse, WorkflowStatus, WorkflowControlRequest
-    from .database import Database
-    from .workflow_engine import WorkflowEngine
-except ImportError:
-    # Fallback for direct execution
-    from app.models import TriggerRequest, WorkflowRunResponse, WorkflowStatus
-    from app.database import Database
-    from app.workflow_engine import WorkflowEngine
-
-app = FastAPI(title="Mini-Zaps Workflow Builder", version="0.1.0")
 database = Database()
 workflow_engine = WorkflowEngine(database)
 
-@app.on_event("startup")
-async def startup_event():
+_ROOT_JSON = orjson.dumps({"message": "Mini-Zaps Workflow Builder API", "status": "running"})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     try:
         await database.init_db()
         print("✅ Database initialized successfully")
     except Exception as e:
         print(f"❌ Database initialization failed: {e}")
         raise
+    
+    # One pooled client for the whole process so webhook steps reuse connections
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_keepalive_connections=100,
+            max_connections=200,
+            keepalive_expiry=30.0
+        ),
+        timeout=httpx.Timeout(30.0)
+    )
+    app.state.http_client = http_client
+    workflow_engine.http_client = http_client
+    
+    workers = os.getenv("MZ_WORKFLOW_WORKERS")
+    workflow_engine.start_workers(int(workers) if workers else None)
+    try:
+        yield
+    finally:
+        await workflow_engine.stop_workers()
+        workflow_engine.http_client = None
+        await http_client.aclose()
+
+app = FastAPI(
+    title="Mini-Zaps Workflow Builder",
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 @app.post("/api/trigger", response_model=WorkflowRunResponse)
-async def trigger_workflow(
-    request: TriggerRequest,
-    background_tasks: BackgroundTasks
-):
+async def trigger_workflow(request: TriggerRequest):
     """Trigger a workflow execution"""
     try:
         # Create workflow run record
@@ -44,25 +65,21 @@ async def trigger_workflow(
             request.max_retries
         )
         
-        # Start workflow execution in background
-        background_tasks.add_task(
-            workflow_engine.execute_workflow,
-            run.id,
-            request.workflow_name,
-            request.payload
-        )
+        # Hand the run to the worker pool; reject rather than pile up when saturated
+        try:
+            workflow_engine.enqueue_workflow(run.id, request.workflow_name, request.payload)
+        except asyncio.QueueFull:
+            await database.update_workflow_run(
+                run.id, WorkflowStatus.FAILED, [(0, "Rejected: workflow queue is full")]
+            )
+            raise HTTPException(status_code=503, detail="Workflow queue is full, try again later")
         
-        return WorkflowRunResponse(
-            id=run.id,
-            workflow_name=run.workflow_name,
-            status=run.status,
-            retry_count=run.retry_count,
-            max_retries=run.max_retries,
-            current_step=run.current_step,
-            created_at=run.created_at,
-            updated_at=run.updated_at
-        )
+        # The row comes straight from the database; returning a response directly
+        # skips response_model validation (the model still documents the schema)
+        return ORJSONResponse(content=dict(run._mapping))
         
+    except HTTPException:
+        raise
     except FileNotFoundError as e:
         print(f"❌ Workflow not found: {e}")
         raise HTTPException(status_code=404, detail="Workflow not found")
@@ -78,16 +95,20 @@ async def control_workflow(run_id: int, request: WorkflowControlRequest):
         
         if action == "pause":
             success = await database.pause_workflow(run_id)
+            if success:
+                workflow_engine.apply_control(run_id, WorkflowStatus.PAUSED)
             message = "Workflow paused" if success else "Could not pause workflow"
         elif action == "stop":
             success = await database.stop_workflow(run_id)
+            if success:
+                # Let a paused run notice the stop instead of waiting forever
+                workflow_engine.apply_control(run_id, WorkflowStatus.STOPPED)
             message = "Workflow stopped" if success else "Could not stop workflow"
         elif action == "resume":
             success = await database.resume_workflow(run_id)
             if success:
-                # Get the workflow info to resume execution
-                run = await database.get_workflow_run(run_id)
-                # Note: In production, you'd use a proper queue system to resume
+                # Wake the paused run; it continues from its current step
+                workflow_engine.apply_control(run_id, WorkflowStatus.STARTED)
                 message = "Workflow resumed (will continue from current step)"
             else:
                 message = "Could not resume workflow"
@@ -106,49 +127,39 @@ async def control_workflow(run_id: int, request: WorkflowControlRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/runs/{run_id}")
-async def get_workflow_run(run_id: int):
-    """Get workflow run status and logs"""
+async def get_workflow_run(run_id: int, tail: Optional[int] = Query(None, ge=1)):
+    """Get workflow run status and logs (optionally only the last `tail` lines)"""
     try:
-        run = await database.get_workflow_run(run_id)
+        run = await database.get_workflow_run_summary(run_id)
         if not run:
             raise HTTPException(status_code=404, detail="Workflow run not found")
         
-        import json
-        return {
-            "id": run.id,
-            "workflow_name": run.workflow_name,
-            "status": run.status,
-            "retry_count": run.retry_count,
-            "max_retries": run.max_retries,
-            "current_step": run.current_step,
-            "logs": json.loads(run.logs) if run.logs else [],
-            "created_at": run.created_at,
-            "updated_at": run.updated_at
-        }
+        # Stream the run fields, then the logs batch by batch, so the full
+        # log history is never held in memory
+        header = orjson.dumps(dict(run._mapping))[:-1] + b',"logs":['
+        
+        async def body():
+            yield header
+            separator = b""
+            async for batch in database.stream_run_logs(run_id, tail):
+                yield separator + b",".join(orjson.dumps(msg) for msg in batch)
+                separator = b","
+            yield b"]}"
+        
+        return StreamingResponse(body(), media_type="application/json")
     except HTTPException:
         raise
     except Exception as e:
         print(f"❌ Error getting workflow run {run_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/runs")
+@app.get("/api/runs", response_class=ORJSONResponse)
 async def list_workflow_runs(limit: int = 100):
     """List recent workflow runs"""
     try:
         runs = await database.get_workflow_runs(limit)
-        return [
-            WorkflowRunResponse(
-                id=run.id,
-                workflow_name=run.workflow_name,
-                status=run.status,
-                retry_count=run.retry_count,
-                max_retries=run.max_retries,
-                current_step=run.current_step,
-                created_at=run.created_at,
-                updated_at=run.updated_at
-            )
-            for run in runs
-        ]
+        # Rows come from a projected query, so hand them to orjson unvalidated
+        return ORJSONResponse(content=[dict(run._mapping) for run in runs])
     except Exception as e:
         print(f"❌ Error listing workflow runs: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -169,17 +180,14 @@ async def list_active_workflows():
 async def list_connectors():
     """List available connector types and their schemas"""
     try:
-        return {
-            name: connector_class.get_config_schema()
-            for name, connector_class in workflow_engine.connectors.items()
-        }
+        return Response(content=workflow_engine.connector_schemas_json, media_type="application/json")
     except Exception as e:
         print(f"❌ Error listing connectors: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/")
 async def root():
-    return {"message": "Mini-Zaps Workflow Builder API", "status": "running"}
+    return Response(content=_ROOT_JSON, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
@@ -200,6 +208,7 @@ async def health_check():
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
 
 if __name__ == "__main__":
+    # Run as a module (python -m app.main) so the package-relative imports resolve
     import uvicorn
     print("🚀 Starting Mini-Zaps Workflow Builder...")
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -2,7 +2,7 @@ from enum import Enum
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, DateTime, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Index, Enum as SQLEnum
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
@@ -22,13 +22,28 @@ class WorkflowRun(Base):
     id = Column(Integer, primary_key=True, index=True)
     workflow_name = Column(String, index=True)
     status = Column(SQLEnum(WorkflowStatus), default=WorkflowStatus.STARTED)
-    trigger_payload = Column(Text)  # JSON string
-    logs = Column(Text)  # JSON string
+    trigger_payload = Column(JSON)
     retry_count = Column(Integer, default=0)
     max_retries = Column(Integer, default=3)
     current_step = Column(Integer, default=0)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (
+        # Serves the newest-first run listing from the index alone
+        Index("ix_workflow_runs_created_at_id", created_at.desc(), id),
+        # Status filters (active/paused runs, monitoring) probe this instead of scanning
+        Index("ix_workflow_runs_status_updated", status, updated_at),
+    )
+
+class WorkflowRunLog(Base):
+    """One log line of a workflow run; appended instead of rewriting a JSON blob"""
+    __tablename__ = "workflow_run_logs"
+    
+    run_id = Column(Integer, ForeignKey("workflow_runs.id"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    ts = Column(DateTime, default=func.now())
+    msg = Column(Text)
 
 # Pydantic models for API
 class TriggerRequest(BaseModel):
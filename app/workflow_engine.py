@@ -1,82 +1,261 @@
 import asyncio
 import json
 import yaml
-import sys
+import httpx
+import orjson
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
+from sqlalchemy.ext.asyncio import AsyncSession
 
-# Add the parent directory to the path so we can import from app
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from .models import WorkflowDefinition, WorkflowStatus, WorkflowStep, WorkflowControlRequest
+from .database import Database
+from .connectors.base import BaseConnector, ConnectorResult
+from .connectors.delay import DelayConnector
+from .connectors.webhook import WebhookConnector
 
-try:
-    from .models import WorkflowDefinition, WorkflowStatus, WorkflowStep, WorkflowControlRequest
-    from .database import Database
-    from .connectors.base import BaseConnector
-    from .connectors.delay import DelayConnector
-    from .connectors.webhook import WebhookConnector
-except ImportError:
-    # Fallback for direct execution
-    from app.models import WorkflowDefinition, WorkflowStatus, WorkflowControlRequest
-    from app.database import Database
-    from app.connectors.base import BaseConnector
-    from app.connectors.delay import DelayConnector
-    from app.connectors.webhook import WebhookConnector
+# Prefer the libyaml C parser when PyYAML was built with it
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Returned by retry_step when a pause or stop cancels the retries, as opposed
+# to None when every attempt failed
+_RETRY_CANCELLED = object()
+
+# Exponential retry backoff in seconds, indexed by attempt (2^attempt, capped)
+_BACKOFF = tuple(2 ** i for i in range(16))
+
+# asyncio.timeout (3.11+) cancels in place instead of wrapping the step in a Task
+_asyncio_timeout = getattr(asyncio, "timeout", None)
+
+class RunLog:
+    """Buffers a run's log lines until they are flushed to the database"""
+    def __init__(self):
+        self.next_seq = 0
+        self.pending: List[Tuple[int, str]] = []
+    
+    def append(self, message: str):
+        self.pending.append((self.next_seq, message))
+        self.next_seq += 1
+    
+    def drain(self) -> List[Tuple[int, str]]:
+        """Return the unflushed lines and clear the buffer"""
+        pending, self.pending = self.pending, []
+        return pending
 
 class WorkflowEngine:
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, http_client: Optional[httpx.AsyncClient] = None):
         self.database = database
+        self.http_client = http_client  # Shared with connectors that make HTTP calls
         self.connectors = {
             "delay": DelayConnector,
             "webhook": WebhookConnector
         }
         self.active_workflows = {}  # Track active workflows for pause/stop
+        self._control_events: Dict[int, asyncio.Event] = {}  # Runs paused or in retry backoff, woken by apply_control
+        self._wf_cache: Dict[str, Tuple[Tuple[int, int], WorkflowDefinition]] = {}  # name -> ((mtime_ns, size), definition)
+        self._queue: Optional[asyncio.Queue] = None  # Pending (run_id, workflow_name, payload) jobs
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[int, asyncio.Task] = {}  # run_id -> task executing the run
+        self._run_state_changed: Optional[asyncio.Event] = None  # Set when a run parks or finishes, for stop_workers
+        self._connector_schemas_json: Optional[bytes] = None  # Built on first use
+    
+    def start_workers(self, count: Optional[int] = None, queue_size: int = 1024):
+        """Start a fixed pool of tasks that execute queued workflow runs"""
+        if count is None:
+            count = (os.cpu_count() or 1) * 4
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._run_state_changed = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(count)]
+    
+    async def stop_workers(self, drain_timeout: float = 30.0):
+        """Give queued runs and runs executing a step time to finish, then cancel the workers.
+        
+        Runs parked on a control event (paused, or in retry backoff) could wait
+        indefinitely, so they are cancelled as soon as they park.
+        """
+        if self._queue is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + drain_timeout
+        while True:
+            for run_id in list(self._control_events):
+                task = self._running.get(run_id)
+                if task is not None:
+                    task.cancel()
+            busy = [run_id for run_id in self._running if run_id not in self._control_events]
+            if not busy and self._queue.empty():
+                break
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                print(f"⚠️  {len(busy)} workflow(s) still running at shutdown")
+                break
+            self._run_state_changed.clear()
+            try:
+                await asyncio.wait_for(self._run_state_changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        
+        tasks = list(self._running.values()) + self._workers
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+    
+    def enqueue_workflow(self, run_id: int, workflow_name: str, trigger_payload: Dict[str, Any]):
+        """Queue a run for execution; raises asyncio.QueueFull when the backlog is full"""
+        if self._queue is None:
+            raise RuntimeError("Workflow workers are not running")
+        self._queue.put_nowait((run_id, workflow_name, trigger_payload))
+    
+    async def _worker(self):
+        while True:
+            run_id, workflow_name, trigger_payload = await self._queue.get()
+            # Its own task, so stop_workers can cancel a parked run without losing the worker
+            task = asyncio.create_task(self.execute_workflow(run_id, workflow_name, trigger_payload))
+            self._running[run_id] = task
+            try:
+                await asyncio.wait((task,))
+                if not task.cancelled() and task.exception() is not None:
+                    print(f"❌ Worker error on workflow run {run_id}: {task.exception()}")
+            finally:
+                self._running.pop(run_id, None)
+                self._queue.task_done()
+                self._run_state_changed.set()
+    
+    def _park(self, run_id: int) -> asyncio.Event:
+        """Register the event a paused or backing-off run waits on for control actions"""
+        event = asyncio.Event()
+        self._control_events[run_id] = event
+        if self._run_state_changed is not None:
+            self._run_state_changed.set()
+        return event
     
     def register_connector(self, name: str, connector_class):
         """Register a new connector type"""
         self.connectors[name] = connector_class
+        self._connector_schemas_json = None
+    
+    @property
+    def connector_schemas_json(self) -> bytes:
+        """Serialized {name: config schema} of all connectors; schemas are static per class"""
+        if self._connector_schemas_json is None:
+            self._connector_schemas_json = orjson.dumps({
+                name: connector_class.get_config_schema()
+                for name, connector_class in self.connectors.items()
+            })
+        return self._connector_schemas_json
+    
+    def apply_control(self, run_id: int, status: WorkflowStatus):
+        """Record a status change made through the control API and wake the run if it is waiting"""
+        active = self.active_workflows.get(run_id)
+        if active is not None:
+            active["status"] = status
+        event = self._control_events.get(run_id)
+        if event is not None:
+            event.set()
     
     async def load_workflow_definition(self, workflow_name: str) -> WorkflowDefinition:
-        """Load workflow definition from YAML file"""
+        """Load workflow definition from YAML file, reusing the parsed result until the file changes"""
         workflow_path = Path(f"workflows/{workflow_name}.yaml")
-        if not workflow_path.exists():
+        try:
+            stat = workflow_path.stat()
+        except FileNotFoundError:
+            self._wf_cache.pop(workflow_name, None)
             raise FileNotFoundError(f"Workflow {workflow_name} not found")
         
-        with open(workflow_path, 'r') as f:
-            data = yaml.safe_load(f)
+        # Size catches rewrites that land within the filesystem's mtime granularity
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._wf_cache.get(workflow_name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
         
-        return WorkflowDefinition(**data)
+        data = yaml.load(workflow_path.read_bytes(), Loader=_YamlLoader)
+        definition = WorkflowDefinition.model_validate(data)
+        self._wf_cache[workflow_name] = (key, definition)
+        return definition
     
-    async def check_workflow_status(self, run_id: int) -> WorkflowStatus:
+    async def check_workflow_status(self, run_id: int, session: Optional[AsyncSession] = None) -> WorkflowStatus:
         """Check current workflow status from database"""
-        run = await self.database.get_workflow_run(run_id)
-        return run.status if run else WorkflowStatus.STOPPED
+        status = await self.database.get_workflow_status(run_id, session=session)
+        return status if status is not None else WorkflowStatus.STOPPED
+    
+    def prepare_steps(self, workflow_def: WorkflowDefinition) -> List[Tuple[WorkflowStep, BaseConnector, bool]]:
+        """Validate step types and build each step's connector once per run"""
+        prepared = []
+        for step in workflow_def.steps:
+            connector_class = self.connectors.get(step.type)
+            if connector_class is None:
+                raise ValueError(f"Unknown connector type: {step.type}")
+            if connector_class.accepts_engine_options:
+                connector = connector_class(
+                    step.config, http_client=self.http_client, timeout_seconds=step.timeout_seconds
+                )
+            else:
+                # Plain __init__(config) connector: attach the options afterwards so
+                # execute_step still applies the step timeout
+                connector = connector_class(step.config)
+                connector.http_client = self.http_client
+                connector.timeout_seconds = step.timeout_seconds
+            prepared.append((step, connector, step.retry_on_failure))
+        return prepared
+    
+    async def execute_step(self, connector: BaseConnector, context: Dict[str, Any]) -> ConnectorResult:
+        """Run a connector, applying its step timeout unless the connector enforces it itself"""
+        timeout_seconds = connector.timeout_seconds
+        if not timeout_seconds or connector.handles_timeout:
+            return await connector.execute(context)
+        try:
+            if _asyncio_timeout is not None:
+                async with _asyncio_timeout(timeout_seconds):
+                    return await connector.execute(context)
+            return await asyncio.wait_for(connector.execute(context), timeout=timeout_seconds)
+        except asyncio.TimeoutError:
+            return ConnectorResult(
+                success=False,
+                message=f"Step timed out after {timeout_seconds}s"
+            )
     
-    async def retry_step(self, run_id: int, step_index: int, step: WorkflowStep, context: Dict[str, Any], logs: List[str], max_retries: int = 3):
+    def _retry_cancelled(self, run_id: int, step_index: int, logs: RunLog) -> bool:
+        current_status = self.active_workflows[run_id]["status"]
+        if current_status in [WorkflowStatus.STOPPED, WorkflowStatus.PAUSED]:
+            logs.append(f"Step {step_index + 1} retry cancelled due to workflow {current_status.value}")
+            return True
+        return False
+    
+    async def _sleep_unless_controlled(self, run_id: int, delay: float):
+        """Sleep for delay seconds, returning early if a control action arrives for the run"""
+        event = self._park(run_id)
+        try:
+            await asyncio.wait_for(event.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._control_events.pop(run_id, None)
+    
+    async def retry_step(self, run_id: int, step_index: int, connector: BaseConnector, context: Dict[str, Any], logs: RunLog, max_retries: int = 3, session: Optional[AsyncSession] = None):
         """Retry a failed step with exponential backoff"""
         for attempt in range(max_retries):
-            # Check if workflow was stopped/paused during retry
-            current_status = await self.check_workflow_status(run_id)
-            if current_status in [WorkflowStatus.STOPPED, WorkflowStatus.PAUSED]:
-                logs.append(f"Step {step_index + 1} retry cancelled due to workflow {current_status.value}")
-                return None
-            
             if attempt > 0:
+                if attempt == 1:
+                    if self._retry_cancelled(run_id, step_index, logs):
+                        return _RETRY_CANCELLED
+                    # Mark the run as retrying once, not on every attempt
+                    self.active_workflows[run_id]["status"] = WorkflowStatus.RETRYING
+                    await self.database.update_workflow_run(
+                        run_id, WorkflowStatus.RETRYING, logs.drain(), current_step=step_index, session=session
+                    )
+                
                 # Exponential backoff: 2^attempt seconds
-                delay = 2 ** attempt
+                delay = _BACKOFF[min(attempt, len(_BACKOFF) - 1)]
                 logs.append(f"Step {step_index + 1} retry {attempt + 1}/{max_retries} in {delay}s...")
-                await asyncio.sleep(delay)
-                
-                # Update status to retrying
-                await self.database.update_workflow_run(
-                    run_id, WorkflowStatus.RETRYING, logs, current_step=step_index
-                )
+                await self._sleep_unless_controlled(run_id, delay)
             
-            # Get connector and execute
-            connector_class = self.connectors[step.type]
-            connector = connector_class(step.config)
+            # Check if workflow was stopped/paused during retry
+            if self._retry_cancelled(run_id, step_index, logs):
+                return _RETRY_CANCELLED
             
-            result = await connector.execute(context)
+            result = await self.execute_step(connector, context)
             
             if result.success:
                 logs.append(f"Step {step_index + 1} succeeded on retry {attempt + 1}")
@@ -88,22 +267,33 @@ class WorkflowEngine:
     
     async def execute_workflow(self, run_id: int, workflow_name: str, trigger_payload: Dict[str, Any]):
         """Execute a workflow with pause/stop/retry support"""
-        logs = [f"Starting workflow: {workflow_name}"]
+        logs = RunLog()
+        logs.append(f"Starting workflow: {workflow_name}")
         
-        # Add to active workflows for control
+        # Add to active workflows for control; "status" mirrors the DB so the
+        # step loop can check it without a query (kept current by apply_control).
+        # None until the run row is read, so any control action in between wins
         self.active_workflows[run_id] = {
-            "status": "running",
+            "status": None,
             "current_step": 0
         }
         
+        # One session serves every database call of this run
+        session = self.database.run_session()
         try:
             # Load workflow definition
             workflow_def = await self.load_workflow_definition(workflow_name)
+            prepared = self.prepare_steps(workflow_def)
             
             # Get workflow run info for retry settings
-            run = await self.database.get_workflow_run(run_id)
+            run = await self.database.get_workflow_run(run_id, session=session)
             max_retries = run.max_retries if run else 3
             
+            # A pause or stop issued while the run waited in the queue only reached
+            # the DB; adopt it unless apply_control has updated the cache since
+            if self.active_workflows[run_id]["status"] is None:
+                self.active_workflows[run_id]["status"] = run.status if run else WorkflowStatus.STARTED
+            
             # Initialize context with trigger payload
             context = {
                 "trigger": trigger_payload,
@@ -111,25 +301,37 @@ class WorkflowEngine:
                 "workflow_name": workflow_name
             }
             
-            # Execute each step
-            for i, step in enumerate(workflow_def.steps):
+            # Execute each step; i only advances once a step is done, so a step
+            # whose retries were paused runs again after the resume
+            i = 0
+            while i < len(prepared):
+                step, connector, retry_on_failure = prepared[i]
+                # Flush the previous step's log lines in one batch
+                await self.database.append_run_logs(run_id, logs.drain(), session=session)
+                
                 # Check workflow status before each step
-                current_status = await self.check_workflow_status(run_id)
+                current_status = self.active_workflows[run_id]["status"]
                 
                 if current_status == WorkflowStatus.STOPPED:
                     logs.append(f"Workflow stopped at step {i + 1}")
                     break
                 elif current_status == WorkflowStatus.PAUSED:
                     logs.append(f"Workflow paused at step {i + 1}")
+                    resume_event = self._park(run_id)
                     await self.database.update_workflow_run(
-                        run_id, WorkflowStatus.PAUSED, logs, current_step=i
+                        run_id, WorkflowStatus.PAUSED, logs.drain(), current_step=i, session=session
                     )
-                    # Wait for resume (this is simplified - in production you'd use a proper queue system)
-                    while await self.check_workflow_status(run_id) == WorkflowStatus.PAUSED:
-                        await asyncio.sleep(1)
+                    # Sleep until control_workflow signals a resume or stop
+                    while True:
+                        await resume_event.wait()
+                        current_status = await self.check_workflow_status(run_id, session=session)
+                        self.active_workflows[run_id]["status"] = current_status
+                        if current_status != WorkflowStatus.PAUSED:
+                            break
+                        resume_event.clear()
+                    self._control_events.pop(run_id, None)
                     
                     # Check if it was resumed or stopped
-                    current_status = await self.check_workflow_status(run_id)
                     if current_status == WorkflowStatus.STOPPED:
                         logs.append(f"Workflow stopped during pause at step {i + 1}")
                         break
@@ -142,54 +344,39 @@ class WorkflowEngine:
                 step_log = f"Executing step {i + 1}: {step.type}"
                 logs.append(step_log)
                 
-                # Get connector class
-                if step.type not in self.connectors:
-                    raise ValueError(f"Unknown connector type: {step.type}")
-                
-                connector_class = self.connectors[step.type]
-                connector = connector_class(step.config)
-                
-                # Execute step with timeout if specified
-                try:
-                    if hasattr(step, 'timeout_seconds') and step.timeout_seconds:
-                        result = await asyncio.wait_for(
-                            connector.execute(context), 
-                            timeout=step.timeout_seconds
-                        )
-                    else:
-                        result = await connector.execute(context)
-                except asyncio.TimeoutError:
-                    result = type('Result', (), {
-                        'success': False, 
-                        'message': f'Step timed out after {step.timeout_seconds}s',
-                        'data': {}
-                    })()
+                result = await self.execute_step(connector, context)
                 
                 if result.success:
                     logs.append(f"Step {i + 1} succeeded: {result.message}")
                     # Add step result to context for next steps
                     context[f"step_{i + 1}"] = result.data
+                    i += 1
                 else:
                     logs.append(f"Step {i + 1} failed: {result.message}")
                     
                     # Check if we should retry this step
-                    should_retry = getattr(step, 'retry_on_failure', True)
-                    if should_retry and max_retries > 0:
+                    if retry_on_failure and max_retries > 0:
                         logs.append(f"Attempting to retry step {i + 1}...")
-                        retry_result = await self.retry_step(i, step, context, logs, max_retries)
+                        retry_result = await self.retry_step(
+                            run_id, i, connector, context, logs, max_retries, session=session
+                        )
                         
+                        if retry_result is _RETRY_CANCELLED:
+                            # Back to the status check: stop, or wait for resume and rerun the step
+                            continue
                         if retry_result and retry_result.success:
                             context[f"step_{i + 1}"] = retry_result.data
+                            i += 1
                             continue
                     
                     # Step failed after retries
                     await self.database.update_workflow_run(
-                        run_id, WorkflowStatus.FAILED, logs, current_step=i
+                        run_id, WorkflowStatus.FAILED, logs.drain(), current_step=i, session=session
                     )
                     return
             
             # Check final status
-            final_status = await self.check_workflow_status(run_id)
+            final_status = self.active_workflows[run_id]["status"]
             if final_status == WorkflowStatus.STOPPED:
                 logs.append("Workflow was stopped")
             elif final_status == WorkflowStatus.PAUSED:
@@ -197,14 +384,17 @@ class WorkflowEngine:
             else:
                 logs.append("Workflow completed successfully")
                 await self.database.update_workflow_run(
-                    run_id, WorkflowStatus.SUCCEEDED, logs
+                    run_id, WorkflowStatus.SUCCEEDED, logs.drain(), session=session
                 )
+            await self.database.append_run_logs(run_id, logs.drain(), session=session)
             
         except Exception as e:
             logs.append(f"Workflow failed with error: {str(e)}")
             await self.database.update_workflow_run(
-                run_id, WorkflowStatus.FAILED, logs
+                run_id, WorkflowStatus.FAILED, logs.drain(), session=session
             )
         finally:
+            await session.close()
             # Remove from active workflows
-            self.active_workflows.pop(run_id, None)
\ No newline at end of file
+            self.active_workflows.pop(run_id, None)
+            self._control_events.pop(run_id, None)
\ No newline at end of file
@@ -4,98 +4,164 @@ Debug script to test Mini-Zaps components individually
 Run this to troubleshoot issues
 """
 
+import argparse
 import asyncio
+import importlib.util
 import sys
 import os
+import time
+import traceback
 from pathlib import Path
 
-# Add the current directory to the path
-sys.path.append(os.getcwd())
+import aiofiles
+import httpx
+from sqlalchemy import text
+
+from app.connectors import get_connector
+from app.database import Database
+from app.models import WorkflowStatus
+from app.workflow_engine import WorkflowEngine
+
+try:
+    import uvloop  # installed by uvicorn[standard]; not available on Windows
+except ImportError:
+    uvloop = None
+
+class Log:
+    """Collects one test section's output and prints it in a single write"""
+    
+    def __init__(self):
+        self.buf = []
+    
+    def line(self, msg):
+        self.buf.append(msg)
+    
+    def ok(self, msg):
+        self.buf.append(f"✅ {msg}")
+    
+    def fail(self, msg):
+        self.buf.append(f"❌ {msg}")
+    
+    def flush(self):
+        if self.buf:
+            print("\n".join(self.buf))
+            self.buf.clear()
+
+_db = None
+_db_lock = asyncio.Lock()
+
+async def _get_db():
+    """Create and initialize the Database once, shared by every test"""
+    global _db
+    async with _db_lock:
+        if _db is None:
+            db = Database()
+            await db.init_db()
+            _db = db
+    return _db
 
 async def test_database():
     """Test database operations"""
-    print("🔍 Testing Database...")
+    log = Log()
+    log.line("🔍 Testing Database...")
     
     try:
-        from app.database import Database
-        from app.models import WorkflowStatus
-        from sqlalchemy import text
-        
-        db = Database()
-        await db.init_db()
-        print("✅ Database initialized")
+        db = await _get_db()
+        log.ok("Database initialized")
         
-        # Test database connection
         async with db.async_session() as session:
-            result = await session.execute(text("SELECT 1"))
-            print("✅ Database connection test passed")
-        
-        # Test creating a workflow run
-        run = await db.create_workflow_run("test_workflow", {"test": "data"})
-        print(f"✅ Created workflow run: {run.id}")
-        
-        # Test getting the run
-        retrieved_run = await db.get_workflow_run(run.id)
-        print(f"✅ Retrieved workflow run: {retrieved_run.workflow_name}")
+            async with session.begin():
+                # Test database connection
+                await session.execute(text("SELECT 1"))
+                log.ok("Database connection test passed")
+                
+                # Test creating a workflow run; committed here so other sessions can see it
+                run = await db.create_workflow_run("test_workflow", {"test": "data"}, session=session)
+                log.ok(f"Created workflow run: {run.id}")
+            
+            # Test getting the run and listing runs; independent reads, each on its own pooled connection
+            retrieved_run, runs = await asyncio.gather(
+                db.get_workflow_run(run.id),
+                db.get_workflow_runs(10)
+            )
+            log.ok(f"Retrieved workflow run: {retrieved_run.workflow_name}")
+            log.ok(f"Listed {len(runs)} workflow runs")
+            
+            # Test updating run status
+            async with session.begin():
+                await db.update_workflow_run(run.id, WorkflowStatus.SUCCEEDED, [(0, "Test log")], session=session)
+            log.ok("Updated workflow run status")
         
-        # Test listing runs
-        runs = await db.get_workflow_runs(10)
-        print(f"✅ Listed {len(runs)} workflow runs")
-        
-        # Test updating run status
-        await db.update_workflow_run(run.id, WorkflowStatus.SUCCEEDED, ["Test log"])
-        print("✅ Updated workflow run status")
-        
-        print("🎉 Database tests passed!\n")
+        log.line("🎉 Database tests passed!\n")
         return True
         
     except Exception as e:
-        print(f"❌ Database test failed: {e}")
-        import traceback
-        traceback.print_exc()
+        log.fail(f"Database test failed: {e}")
+        traceback.print_exception(type(e), e, e.__traceback__, limit=5, file=sys.stderr)
         return False
+    finally:
+        log.flush()
 
 async def test_connectors():
     """Test connector functionality"""
-    print("🔍 Testing Connectors...")
+    log = Log()
+    log.line("🔍 Testing Connectors...")
     
     try:
-        from app.connectors.delay import DelayConnector
-        from app.connectors.webhook import WebhookConnector
-        
-        # Test delay connector
-        delay_connector = DelayConnector({"seconds": 1})
-        result = await delay_connector.execute({"test": "context"})
-        if result.success:
-            print("✅ Delay connector works")
-        else:
-            print(f"❌ Delay connector failed: {result.message}")
-            return False
+        DelayConnector = get_connector("delay")
+        WebhookConnector = get_connector("webhook")
+        
+        # Webhook requests are answered in-process, so no network is needed
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+        connectors = [
+            (DelayConnector, {"seconds": 0}),  # Covers the code path without a real wait
+            (WebhookConnector, {"url": "http://mini-zaps.test/hook", "body": {"value": "{{test}}"}}),
+        ]
+        
+        # Smoke-test every connector at once, at most 8 in flight
+        sem = asyncio.Semaphore(8)
+        
+        async def run_connector(connector_class, config):
+            async with sem:
+                connector = connector_class(config, http_client=http_client)
+                return await connector.execute({"test": "context"})
+        
+        try:
+            results = await asyncio.gather(*(run_connector(c, cfg) for c, cfg in connectors))
+        finally:
+            await http_client.aclose()
+        
+        for (connector_class, _), result in zip(connectors, results):
+            if result.success:
+                log.ok(f"{connector_class.__name__} works: {result.message}")
+            else:
+                log.fail(f"{connector_class.__name__} failed: {result.message}")
+                return False
         
         # Test webhook connector schema
         webhook_schema = WebhookConnector.get_config_schema()
-        print(f"✅ Webhook connector schema: {len(webhook_schema['properties'])} properties")
+        log.ok(f"Webhook connector schema: {len(webhook_schema['properties'])} properties")
         
-        print("🎉 Connector tests passed!\n")
+        log.line("🎉 Connector tests passed!\n")
         return True
         
     except Exception as e:
-        print(f"❌ Connector test failed: {e}")
-        import traceback
-        traceback.print_exc()
+        log.fail(f"Connector test failed: {e}")
+        traceback.print_exception(type(e), e, e.__traceback__, limit=5, file=sys.stderr)
         return False
+    finally:
+        log.flush()
 
 async def test_workflow_engine():
     """Test workflow engine"""
-    print("🔍 Testing Workflow Engine...")
+    log = Log()
+    log.line("🔍 Testing Workflow Engine...")
     
     try:
-        from app.workflow_engine import WorkflowEngine
-        from app.database import Database
-        
         # Create test workflow file
         workflow_dir = Path("workflows")
-        workflow_dir.mkdir(exist_ok=True)
+        # Keep file I/O off the event loop so the other gathered tests keep running
+        await asyncio.to_thread(workflow_dir.mkdir, exist_ok=True)
         
         test_workflow = """
 name: debug_workflow
@@ -105,66 +171,90 @@ steps:
       seconds: 1
 """
         
-        with open(workflow_dir / "debug_workflow.yaml", "w") as f:
-            f.write(test_workflow)
+        async with aiofiles.open(workflow_dir / "debug_workflow.yaml", "w") as f:
+            await f.write(test_workflow)
         
-        db = Database()
-        await db.init_db()
-        
-        engine = WorkflowEngine(db)
+        engine = WorkflowEngine(await _get_db())
         
         # Test loading workflow definition
+        start = time.perf_counter()
         workflow_def = await engine.load_workflow_definition("debug_workflow")
-        print(f"✅ Loaded workflow: {workflow_def.name} with {len(workflow_def.steps)} steps")
+        cold_ms = (time.perf_counter() - start) * 1000
+        log.ok(f"Loaded workflow: {workflow_def.name} with {len(workflow_def.steps)} steps ({cold_ms:.2f} ms)")
+        
+        # A second load of the unchanged file should come from the engine's cache
+        start = time.perf_counter()
+        cached_def = await engine.load_workflow_definition("debug_workflow")
+        warm_ms = (time.perf_counter() - start) * 1000
+        if cached_def is not workflow_def:
+            log.fail("Workflow definition was re-parsed on an unchanged file")
+            return False
+        log.ok(f"Cached workflow reload ({warm_ms:.3f} ms)")
         
-        print("🎉 Workflow engine tests passed!\n")
+        log.line("🎉 Workflow engine tests passed!\n")
         return True
         
     except Exception as e:
-        print(f"❌ Workflow engine test failed: {e}")
-        import traceback
-        traceback.print_exc()
+        log.fail(f"Workflow engine test failed: {e}")
+        traceback.print_exception(type(e), e, e.__traceback__, limit=5, file=sys.stderr)
+        return False
+    finally:
+        log.flush()
+
+def _module_exists(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:  # A parent package is missing
         return False
 
 def check_files():
-    """Check if all required files exist"""
+    """Check if all required modules can be found"""
     print("🔍 Checking Project Structure...")
     
-    required_files = [
-        "app/__init__.py",
-        "app/main.py",
-        "app/models.py",
-        "app/database.py",
-        "app/workflow_engine.py",
-        "app/connectors/__init__.py",
-        "app/connectors/base.py",
-        "app/connectors/delay.py",
-        "app/connectors/webhook.py",
+    # Resolved through the import system, so installed or zipped layouts work too
+    required_modules = [
+        "app",
+        "app.main",
+        "app.models",
+        "app.database",
+        "app.workflow_engine",
+        "app.connectors",
+        "app.connectors.base",
+        "app.connectors.delay",
+        "app.connectors.webhook",
     ]
     
-    missing_files = []
-    for file_path in required_files:
-        if not Path(file_path).exists():
-            missing_files.append(file_path)
-        else:
-            print(f"✅ {file_path}")
+    missing_modules = [m for m in required_modules if not _module_exists(m)]
+    found = [f"✅ {m}" for m in required_modules if m not in missing_modules]
+    if found:
+        print("\n".join(found))
     
-    if missing_files:
-        print(f"\n❌ Missing files:")
-        for missing in missing_files:
+    if missing_modules:
+        print(f"\n❌ Missing modules:")
+        for missing in missing_modules:
             print(f"   - {missing}")
         return False
     
-    print("🎉 All required files found!\n")
+    print("🎉 All required modules found!\n")
     return True
 
 async def main():
+    parser = argparse.ArgumentParser(description="Test Mini-Zaps components individually")
+    parser.add_argument("--fast", action="store_true", help="use an in-memory SQLite database (for CI)")
+    args = parser.parse_args()
+    if args.fast:
+        # Read by Database() when _get_db() first creates it. A named shared-cache
+        # database rather than :memory:, so the pooled connections the concurrent
+        # tests use all see the same in-memory data
+        os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///file:mz_debug?mode=memory&cache=shared&uri=true"
+    
     print("🚀 Mini-Zaps Debug Script")
+    print("   --fast: keep the database in memory instead of workflows.db" + (" (on)" if args.fast else ""))
     print("=" * 40)
     
     # Check project structure
     if not check_files():
-        print("Please create the missing files before continuing.")
+        print("Please create the missing modules before continuing.")
         return
     
     # Test components
@@ -174,10 +264,17 @@ async def main():
         test_workflow_engine
     ]
     
-    results = []
-    for test in tests:
-        result = await test()
-        results.append(result)
+    # Create the schema once up front: two concurrent create_all calls on a
+    # fresh SQLite file deadlock upgrading their read locks to write locks
+    try:
+        await _get_db()
+    except Exception as e:
+        print(f"❌ Database initialization failed: {e}")
+        return
+    
+    # The tests are independent, so let their I/O waits overlap
+    results = await asyncio.gather(*[test() for test in tests], return_exceptions=True)
+    results = [result is True for result in results]
     
     # Summary
     print("📊 Test Summary:")
@@ -193,4 +290,8 @@ async def main():
         print(f"\n❌ {total - passed} tests failed. Please check the errors above.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # Run on the same event loop the server uses
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -5,19 +5,30 @@ Simple script to run the Mini-Zaps server
 Place this in the project root directory
 """
 
+import os
+
 import uvicorn
 
 if __name__ == "__main__":
+    # MZ_DEV=1 turns on auto-reload; otherwise run without the file watcher
+    dev = os.getenv("MZ_DEV") == "1"
+    # Run state, control signals and the worker queue live in-process, so
+    # extra processes only make sense with a shared control channel
+    workers = 1 if dev else int(os.getenv("MZ_WORKERS", "1"))
+    
     print("🚀 Starting Mini-Zaps Workflow Builder...")
     print("📖 API Documentation: http://localhost:8000/docs")
     print("🏥 Health Check: http://localhost:8000")
+    print(f"🔧 MZ_DEV={'1 (auto-reload on)' if dev else '0 (auto-reload off)'}, MZ_WORKERS={workers}")
     print("\nPress Ctrl+C to stop the server\n")
     
     uvicorn.run(
         "app.main:app", 
         host="0.0.0.0", 
         port=8000, 
-        reload=True,
+        reload=dev,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
-